@@ -1,16 +1,73 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, render_template, Response, stream_with_context
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.proxies import WebshareProxyConfig
 import anthropic
+import httpx
+import hashlib
 import os
 import re
-import json
+import threading
+import orjson
+import requests
+from collections import deque
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), 'templates'))
-client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+# HTTP/2 lets concurrent Claude calls (chunk outlines, parallel requests)
+# multiplex over one pooled connection instead of opening a socket each.
+client = anthropic.Anthropic(
+    api_key=os.environ.get("ANTHROPIC_API_KEY"),
+    http_client=anthropic.DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    ),
+)
+
+def _warm_anthropic_pool():
+    """Open the Anthropic TLS connection before the first summary call."""
+    try:
+        client.models.list(limit=1)
+    except Exception:
+        pass
+
+threading.Thread(target=_warm_anthropic_pool, daemon=True).start()
+
+# One keep-alive session for all YouTube HTTP calls, so concurrent and
+# repeat requests reuse pooled connections instead of paying a fresh
+# TCP+TLS handshake each time.
+http_session = requests.Session()
+http_session.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=10, pool_maxsize=32, max_retries=2,
+))
+
+# Completed summaries keyed by video_id, so repeat requests for the same
+# video skip the transcript fetch and the Claude call entirely. The
+# content cache holds the same results keyed by transcript fingerprint,
+# catching reuploads and mirrors that share captions under a new id.
+summary_cache = TTLCache(maxsize=512, ttl=86400)
+content_cache = TTLCache(maxsize=512, ttl=86400)
+summary_cache_lock = threading.Lock()
+
+# Caps in-flight Claude calls (summary streams, chunk outlines, retries)
+# so a traffic burst queues here instead of turning into API 429s and
+# retry storms. Under gevent workers this blocks the greenlet only.
+anthropic_semaphore = threading.BoundedSemaphore(
+    int(os.environ.get("CLAUDE_CONCURRENCY", 8))
+)
+
+SUMMARY_MODEL = "claude-sonnet-4-20250514"
+CHUNK_MODEL = "claude-3-5-haiku-20241022"
+
+# Transcripts up to this length go to the model as-is; longer ones are
+# map-reduced through CHUNK_MODEL first instead of being truncated.
+DIRECT_SUMMARY_LIMIT = 12000
+CHUNK_SIZE = 8000
+CHUNK_OVERLAP = 500
 
 SYSTEM_PROMPT = """You are an expert YouTube video summarizer. Analyze English transcripts and produce rich, structured summaries.
 
@@ -31,19 +88,27 @@ Rules:
 - Return ONLY the JSON, no extra text or markdown
 """
 
+CHUNK_PROMPT = """You summarize one segment of a longer YouTube video transcript.
+
+Respond with a concise plain-text bullet outline (5-10 bullets) of what the segment covers. No preamble, no markdown headers, bullets only.
+"""
+
+# Compiled once at import so per-request calls skip pattern construction
+# and the re module's cache lookup. All URL shapes plus the bare-id case
+# share one alternation, so extraction is a single scan.
+_VIDEO_ID_RE = re.compile(
+    r"(?:v=|youtu\.be/|embed/|shorts/)([a-zA-Z0-9_-]{11})"
+    r"|^([a-zA-Z0-9_-]{11})$"
+)
+_VTT_TAG = re.compile(r"<[^>]+>")
+_VTT_SKIP_PREFIX = ("WEBVTT", "Kind:", "Language:", "NOTE", "STYLE")
+_get_text = attrgetter("text")
+
+
 def extract_video_id(url):
-    patterns = [
-        r"(?:v=)([a-zA-Z0-9_-]{11})",
-        r"(?:youtu\.be/)([a-zA-Z0-9_-]{11})",
-        r"(?:embed/)([a-zA-Z0-9_-]{11})",
-        r"(?:shorts/)([a-zA-Z0-9_-]{11})"
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    if re.match(r"^[a-zA-Z0-9_-]{11}$", url.strip()):
-        return url.strip()
+    match = _VIDEO_ID_RE.search(url.strip())
+    if match:
+        return match.group(1) or match.group(2)
     return None
 
 def create_ytt_client():
@@ -62,35 +127,186 @@ def create_ytt_client():
 
     return YouTubeTranscriptApi()
 
+def parse_vtt_stream(lines):
+    """Pull cue text out of an iterable of VTT lines in a single pass.
+
+    Works on any line iterator (HTTP response, file object), so the
+    caption file is never held in memory as a whole.
+    """
+    pieces = []
+    last = deque(maxlen=1)
+    for raw in lines:
+        line = raw.strip()
+        if not line or line.startswith(_VTT_SKIP_PREFIX) or "-->" in line or line.isdigit():
+            continue
+        line = _VTT_TAG.sub("", line)
+        if not line or (last and last[0] == line):
+            continue
+        last.append(line)
+        pieces.append(line)
+    return " ".join(pieces)
+
+def fetch_timedtext_vtt(video_id):
+    """Fetch English captions straight from YouTube's timedtext endpoint.
+
+    Tries manual captions first, then auto-generated (ASR) ones.
+    """
+    base = f"https://www.youtube.com/api/timedtext?v={video_id}&lang=en&fmt=vtt"
+    for url in (base, base + "&kind=asr"):
+        try:
+            resp = http_session.get(url, timeout=10, stream=True)
+            if resp.status_code != 200:
+                continue
+            resp.encoding = "utf-8"
+            text = parse_vtt_stream(resp.iter_lines(decode_unicode=True))
+            if text:
+                return text
+        except requests.RequestException:
+            continue
+    return None
+
+def _fetch_translated(transcript):
+    """Fetch one candidate transcript (translated to English if needed)."""
+    try:
+        if transcript.is_translatable:
+            fetched = transcript.translate('en').fetch()
+        else:
+            fetched = transcript.fetch()
+        text = " ".join(map(_get_text, fetched))
+        if text and not text.isspace():
+            return text
+    except Exception:
+        pass
+    return None
+
 def get_transcript(video_id):
     ytt = create_ytt_client()
 
     # Try 1: Fetch English directly
     try:
         fetched = ytt.fetch(video_id, languages=['en', 'en-US', 'en-GB', 'en-AU'])
-        text = " ".join([t.text for t in fetched])
-        if text.strip():
+        text = " ".join(map(_get_text, fetched))
+        if text and not text.isspace():
             return text, None
     except Exception:
         pass
 
-    # Try 2: List all and translate to English
+    # Try 2: List all and translate to English, racing the top candidates
+    # instead of walking them one HTTP round trip at a time
+    error = "No usable transcript found. Try a different video."
     try:
-        transcript_list = ytt.list(video_id)
-        for transcript in transcript_list:
-            try:
-                if transcript.is_translatable:
-                    fetched = transcript.translate('en').fetch()
-                else:
-                    fetched = transcript.fetch()
-                text = " ".join([t.text for t in fetched])
-                if text.strip():
-                    return text, None
-            except Exception:
-                continue
-        return None, "No usable transcript found. Try a different video."
+        candidates = list(ytt.list(video_id))[:4]
+        if candidates:
+            with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+                futures = [executor.submit(_fetch_translated, t) for t in candidates]
+                for future in as_completed(futures):
+                    text = future.result()
+                    if text:
+                        for other in futures:
+                            other.cancel()
+                        return text, None
     except Exception as e:
-        return None, f"Could not fetch transcript: {str(e)}"
+        error = f"Could not fetch transcript: {str(e)}"
+
+    # Try 3: Stream-parse YouTube's raw timedtext captions
+    text = fetch_timedtext_vtt(video_id)
+    if text:
+        return text, None
+
+    return None, error
+
+
+def transcript_fingerprint(transcript):
+    """Content key for duplicate uploads: same captions, different video id."""
+    normalized = " ".join(transcript[:2000].lower().split())
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+def _outline_chunk(chunk):
+    with anthropic_semaphore:
+        message = client.messages.create(
+            model=CHUNK_MODEL,
+            max_tokens=400,
+            # Shared across all chunk calls, so only the first one pays
+            # for it.
+            system=[{
+                "type": "text",
+                "text": CHUNK_PROMPT,
+                "cache_control": {"type": "ephemeral"},
+            }],
+            messages=[{
+                "role": "user",
+                "content": f"Transcript segment:\n\n{chunk}"
+            }]
+        )
+    return message.content[0].text.strip()
+
+def condense_transcript(transcript):
+    """Map-reduce a long transcript into per-segment outlines.
+
+    Splits into overlapping chunks, outlines each with the cheap model in
+    parallel, and returns the concatenated outlines for the final summary
+    call -- so long videos keep their full context instead of being cut
+    off at DIRECT_SUMMARY_LIMIT characters.
+    """
+    step = CHUNK_SIZE - CHUNK_OVERLAP
+    chunks = [transcript[i:i + CHUNK_SIZE] for i in range(0, len(transcript), step)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        outlines = list(executor.map(_outline_chunk, chunks))
+    return "\n\n".join(
+        f"Segment {i + 1}:\n{outline}" for i, outline in enumerate(outlines)
+    )
+
+
+# Shape the UI expects; anything else triggers one corrective retry.
+_SUMMARY_STR_FIELDS = ("tldr", "detailed_summary")
+_SUMMARY_LIST_FIELDS = ("key_points", "takeaways", "topics")
+
+
+def _unfence(s):
+    """Return the bare JSON object from model output.
+
+    The instructed common case is bare JSON, caught by one startswith
+    check; fenced or prose-wrapped output falls back to slicing between
+    the outermost braces.
+    """
+    s = s.strip()
+    if s.startswith("{"):
+        return s
+    start, end = s.find("{"), s.rfind("}")
+    if start != -1 and end > start:
+        return s[start:end + 1]
+    return s
+
+
+def decode_summary(raw):
+    """Decode and validate Claude's summary output.
+
+    Returns the summary dict, or None when the output is not valid JSON
+    or does not match the schema the UI renders.
+    """
+    try:
+        result = orjson.loads(_unfence(raw))
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(result, dict):
+        return None
+    if not all(isinstance(result.get(k), str) for k in _SUMMARY_STR_FIELDS):
+        return None
+    if not all(isinstance(result.get(k), list) for k in _SUMMARY_LIST_FIELDS):
+        return None
+    return result
+
+
+def _json_response(data, status=200):
+    return Response(orjson.dumps(data), status=status, mimetype="application/json")
+
+
+def _sse_event(data, event=None):
+    """Format one Server-Sent Events message."""
+    payload = b"data: " + orjson.dumps(data) + b"\n\n"
+    if event:
+        payload = b"event: " + event.encode() + b"\n" + payload
+    return payload
 
 
 @app.route("/")
@@ -104,38 +320,100 @@ def summarize():
     url = data.get("url", "").strip()
 
     if not url:
-        return jsonify({"error": "Please enter a YouTube URL."}), 400
+        return _json_response({"error": "Please enter a YouTube URL."}, status=400)
 
     video_id = extract_video_id(url)
     if not video_id:
-        return jsonify({"error": "Invalid YouTube URL. Please check and try again."}), 400
+        return _json_response({"error": "Invalid YouTube URL. Please check and try again."}, status=400)
 
-    transcript, error = get_transcript(video_id)
-    if error:
-        return jsonify({"error": error}), 400
+    with summary_cache_lock:
+        cached = summary_cache.get(video_id)
+    if cached is not None:
+        return _json_response(cached)
 
-    trimmed_text = transcript[:12000]
+    def generate():
+        transcript, error = get_transcript(video_id)
+        if error:
+            yield _sse_event({"error": error}, event="error")
+            return
 
-    try:
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1500,
-            system=SYSTEM_PROMPT,
-            messages=[{
-                "role": "user",
-                "content": f"Summarize this YouTube video transcript:\n\n{trimmed_text}"
-            }]
-        )
-        raw = message.content[0].text.strip()
-        raw = re.sub(r"^```json\s*", "", raw)
-        raw = re.sub(r"\s*```$", "", raw)
-        result = json.loads(raw)
-        return jsonify(result)
-
-    except json.JSONDecodeError:
-        return jsonify({"error": "AI returned unexpected format. Please try again."}), 500
-    except Exception as e:
-        return jsonify({"error": f"AI error: {str(e)}"}), 500
+        fingerprint = transcript_fingerprint(transcript)
+        with summary_cache_lock:
+            duplicate = content_cache.get(fingerprint)
+        if duplicate is not None:
+            with summary_cache_lock:
+                summary_cache[video_id] = duplicate
+            yield _sse_event(duplicate, event="done")
+            return
+
+        try:
+            if len(transcript) <= DIRECT_SUMMARY_LIMIT:
+                prompt = f"Summarize this YouTube video transcript:\n\n{transcript}"
+            else:
+                outlines = condense_transcript(transcript)
+                prompt = (
+                    "Summarize this YouTube video from these segment outlines "
+                    f"of its full transcript:\n\n{outlines}"
+                )
+
+            parts = []
+            with anthropic_semaphore, client.messages.stream(
+                model=SUMMARY_MODEL,
+                max_tokens=1500,
+                # Cache the static system prompt so repeated requests reuse
+                # the server-side prefix instead of re-paying its input
+                # tokens.
+                system=[{
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                    "cache_control": {"type": "ephemeral"},
+                }],
+                messages=[{
+                    "role": "user",
+                    "content": prompt
+                }]
+            ) as stream:
+                for text in stream.text_stream:
+                    parts.append(text)
+                    yield _sse_event({"delta": text})
+
+            raw = "".join(parts)
+            result = decode_summary(raw)
+            if result is None:
+                # One corrective retry with the bad output in context
+                # instead of failing the whole request
+                with anthropic_semaphore:
+                    retry = client.messages.create(
+                        model=SUMMARY_MODEL,
+                        max_tokens=1500,
+                        system=[{
+                            "type": "text",
+                            "text": SYSTEM_PROMPT,
+                            "cache_control": {"type": "ephemeral"},
+                        }],
+                        messages=[
+                            {"role": "user", "content": prompt},
+                            {"role": "assistant", "content": raw},
+                            {
+                                "role": "user",
+                                "content": "That response was not valid JSON in the required format. Respond again with ONLY the JSON object."
+                            },
+                        ]
+                    )
+                result = decode_summary(retry.content[0].text)
+            if result is None:
+                yield _sse_event({"error": "AI returned unexpected format. Please try again."}, event="error")
+                return
+
+            with summary_cache_lock:
+                summary_cache[video_id] = result
+                content_cache[fingerprint] = result
+            yield _sse_event(result, event="done")
+
+        except Exception as e:
+            yield _sse_event({"error": f"AI error: {str(e)}"}, event="error")
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream")
 
 
 if __name__ == "__main__":